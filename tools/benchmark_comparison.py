@@ -1,89 +1,51 @@
 #!/usr/bin/env python3
 import os
 import re
+import math
+import pickle
+import threading
 import glob
-from bs4 import BeautifulSoup
-import pandas as pd
-import matplotlib.pyplot as plt
-import seaborn as sns
-import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+import orjson
 from pathlib import Path
 
-# Set plot style
-plt.style.use('ggplot')
-sns.set_palette("Set2")
+# pandas and matplotlib are imported inside the functions that need them so
+# start-up stays fast when there are no reports to process
 
-def parse_value_with_unit(value_str):
-    """Parse a string like '562.42 ns' into value and unit."""
-    if not value_str:
-        return 0.0, ""
+# ColorBrewer "Set2" palette used for the logger bars
+SET2_COLORS = ['#66c2a5', '#fc8d62', '#8da0cb', '#e78ac3',
+               '#a6d854', '#ffd92f', '#e5c494', '#b3b3b3']
 
-    match = re.match(r'([\d.]+)\s*(.+)', value_str.strip())
-    if match:
-        return float(match.group(1)), match.group(2).strip()
-    return 0.0, ""
-
-def normalize_to_ns(value, unit):
-    """Convert time values to nanoseconds for consistent comparison."""
-    if unit == "ns":
-        return value
-    elif unit == "�s" or unit == "us":
-        return value * 1000.0
-    elif unit == "ms":
-        return value * 1000000.0
-    elif unit == "s":
-        return value * 1000000000.0
-    return value
-
-def normalize_throughput(value, unit):
-    """Normalize throughput to elements per second."""
-    if "Melem/s" in unit:
-        return value * 1000000.0
-    elif "Kelem/s" in unit:
-        return value * 1000.0
-    return value
+# Pre-compiled patterns used when sorting test names
+_TRAIL_INT_RE = re.compile(r'(\d+)$')
+_SORT_KEY_RE = re.compile(r'^(?P<prefix>.*?)(?P<num>\d+)?$')
+
+# (scale, unit) pairs for display, one entry per factor of 1000
+_TIME_UNITS = [(1.0, 'ns'), (1e3, 'µs'), (1e6, 'ms'), (1e9, 's')]
+_THROUGHPUT_UNITS = [(1.0, 'elem/s'), (1e3, 'Kelem/s'), (1e6, 'Melem/s')]
+
+def _unit_index(value, units):
+    """Pick the display unit for a value from its order of magnitude."""
+    if value < 1:
+        return 0
+    return min(int(math.log10(value) // 3), len(units) - 1)
 
 def format_time(ns_value):
     """Format time values with appropriate units."""
-    if ns_value < 1000:
-        return f"{ns_value:.2f} ns"
-    elif ns_value < 1000000:
-        return f"{ns_value/1000:.2f} �s"
-    elif ns_value < 1000000000:
-        return f"{ns_value/1000000:.2f} ms"
-    else:
-        return f"{ns_value/1000000000:.2f} s"
+    scale, unit = _TIME_UNITS[_unit_index(ns_value, _TIME_UNITS)]
+    return f"{ns_value/scale:.2f} {unit}"
 
 def format_throughput(elem_per_sec):
     """Format throughput values with appropriate units."""
-    if elem_per_sec < 1000:
-        return f"{elem_per_sec:.2f} elem/s"
-    elif elem_per_sec < 1000000:
-        return f"{elem_per_sec/1000:.2f} Kelem/s"
-    else:
-        return f"{elem_per_sec/1000000:.2f} Melem/s"
-
-def parse_criterion_report(html_file):
-    """Parse a Criterion benchmark report HTML file."""
-    try:
-        with open(html_file, 'r', encoding='utf-8') as f:
-            content = f.read()
-    except UnicodeDecodeError:
-        # Try with a different encoding if UTF-8 fails
-        with open(html_file, 'r', encoding='latin-1') as f:
-            content = f.read()
-
-    soup = BeautifulSoup(content, 'html.parser')
-
-    # Extract benchmark name from h2 tag
-    benchmark_name = ""
-    h2_tag = soup.find('h2')
-    if h2_tag:
-        benchmark_name = h2_tag.text.strip()
-
-    # Skip if benchmark name is not found
-    if not benchmark_name:
-        return None
+    scale, unit = _THROUGHPUT_UNITS[_unit_index(elem_per_sec, _THROUGHPUT_UNITS)]
+    return f"{elem_per_sec/scale:.2f} {unit}"
+
+def parse_criterion_benchmark(benchmark_dir):
+    """Parse the JSON results Criterion writes to a benchmark's new/ directory."""
+    with open(os.path.join(benchmark_dir, 'new', 'benchmark.json'), 'rb') as f:
+        benchmark = orjson.loads(f.read())
+
+    benchmark_name = benchmark.get('full_id') or benchmark.get('title', '')
 
     # Parse benchmark name to extract logger and test type
     parts = benchmark_name.split('/')
@@ -94,213 +56,228 @@ def parse_criterion_report(html_file):
     logger_type = parts[1].strip()
     test_type = '/'.join(parts[2:]).strip()  # Join remaining parts as test type
 
-    # Extract metrics from the additional_stats table
-    metrics = {}
-    stats_tables = soup.select('.additional_stats table')
-    if stats_tables:
-        rows = stats_tables[0].select('tbody tr')
-        for row in rows:
-            cells = row.find_all('td')
-            if len(cells) >= 3:
-                metric_name = cells[0].text.strip()
-                # Use the estimate column (middle column)
-                metric_value = cells[1].text.strip()  # Lower bound
-                estimate = cells[2].text.strip()      # Estimate
-                upper_bound = cells[3].text.strip() if len(cells) > 3 else ""  # Upper bound
-
-                metrics[metric_name] = estimate
+    with open(os.path.join(benchmark_dir, 'new', 'estimates.json'), 'rb') as f:
+        estimates = orjson.loads(f.read())
 
+    # Point estimates are already in nanoseconds
     result = {
         'benchmark_name': benchmark_name,
         'logger': logger_type,
         'test_type': test_type,
+        'mean_ns': estimates['mean']['point_estimate'],
+        'median_ns': estimates['median']['point_estimate'],
     }
 
-    # Extract and normalize key metrics
-    if 'Mean' in metrics:
-        mean_value, mean_unit = parse_value_with_unit(metrics['Mean'])
-        result['mean_value'] = mean_value
-        result['mean_unit'] = mean_unit
-        result['mean_ns'] = normalize_to_ns(mean_value, mean_unit)
-
-    if 'Median' in metrics:
-        median_value, median_unit = parse_value_with_unit(metrics['Median'])
-        result['median_value'] = median_value
-        result['median_unit'] = median_unit
-        result['median_ns'] = normalize_to_ns(median_value, median_unit)
-
-    if 'Throughput' in metrics:
-        throughput_value, throughput_unit = parse_value_with_unit(metrics['Throughput'])
-        result['throughput_value'] = throughput_value
-        result['throughput_unit'] = throughput_unit
-        result['throughput_normalized'] = normalize_throughput(throughput_value, throughput_unit)
+    # Criterion reports throughput against the typical time: the slope when
+    # it was measured, otherwise the mean
+    throughput = benchmark.get('throughput') or {}
+    if 'Elements' in throughput:
+        typical = estimates.get('slope') or estimates['mean']
+        result['throughput_normalized'] = throughput['Elements'] * 1e9 / typical['point_estimate']
 
     return result
 
-def find_criterion_reports(base_dir):
-    """Recursively find all Criterion benchmark report index.html files."""
-    report_files = []
-    for root, dirs, files in os.walk(base_dir):
-        if 'index.html' in files and 'report' in root:
-            report_path = os.path.join(root, 'index.html')
-            report_files.append(report_path)
-    return report_files
+def find_criterion_benchmarks(base_dir):
+    """Recursively find all Criterion benchmark directories with results in new/."""
+    benchmark_dirs = []
+
+    def walk(directory):
+        subdirs = []
+        with os.scandir(directory) as entries:
+            for entry in entries:
+                # DirEntry caches the d_type from readdir, so no extra stat per entry
+                if not entry.is_dir(follow_symlinks=False):
+                    continue
+                if entry.name == 'new' and os.path.isfile(os.path.join(entry.path, 'estimates.json')):
+                    benchmark_dirs.append(directory)
+                else:
+                    subdirs.append(entry.path)
+        for subdir in subdirs:
+            walk(subdir)
+
+    if os.path.isdir(base_dir):
+        walk(base_dir)
+    return benchmark_dirs
+
+# Bump whenever parse_criterion_benchmark output changes to invalidate old caches
+REPORT_CACHE_VERSION = 2
+
+def load_report_cache(cache_file):
+    """Load previously parsed reports keyed by (path, mtime_ns, size)."""
+    try:
+        with open(cache_file, 'rb') as f:
+            version, cache = pickle.load(f)
+    except (OSError, EOFError, ValueError, TypeError, pickle.UnpicklingError):
+        return {}
+    return cache if version == REPORT_CACHE_VERSION else {}
+
+def save_report_cache(cache_file, cache):
+    """Persist parsed reports so unchanged files are not parsed again."""
+    with open(cache_file, 'wb') as f:
+        pickle.dump((REPORT_CACHE_VERSION, cache), f, protocol=pickle.HIGHEST_PROTOCOL)
+
+def parse_benchmarks(benchmark_dirs, cache_file):
+    """Parse benchmark results, reusing cached results for benchmarks that have not changed."""
+    cache = load_report_cache(cache_file)
+
+    keys = []
+    for benchmark_dir in benchmark_dirs:
+        stat = os.stat(os.path.join(benchmark_dir, 'new', 'estimates.json'))
+        keys.append((benchmark_dir, stat.st_mtime_ns, stat.st_size))
+
+    missing = [key for key in keys if key not in cache]
+    for key in missing:
+        cache[key] = parse_criterion_benchmark(key[0])
+    print(f"Parsed {len(missing)} benchmarks ({len(keys) - len(missing)} cached)")
+
+    # Only keep entries for benchmarks that still exist on disk
+    cache = {key: cache[key] for key in keys}
+    save_report_cache(cache_file, cache)
+
+    return [cache[key] for key in keys if cache[key]]
 
 def extract_numeric_value(test_type):
     """Extract numeric value from test type for sorting."""
-    match = re.search(r'(\d+)$', test_type)
+    match = _TRAIL_INT_RE.search(test_type)
     if match:
         return int(match.group(1))
     return 0
 
-def custom_sort_key(item):
-    """Custom sort key that handles mixed string/numeric values."""
-    match = re.search(r'(\d+)$', item)
-    if match:
-        # If the string ends with numbers, extract the prefix and the number
-        prefix = item[:match.start()]
-        number = int(match.group(1))
-        # Return a tuple for sorting (prefix first, then number)
-        return (prefix, number)
-    # If no number at the end, just return the string with a 0
-    return (item, 0)
+def sort_subcategories(subcategories):
+    """Sort test names by prefix, then by trailing number (e.g. size_2 before size_10)."""
+    import pandas as pd
+
+    names = pd.Series(list(subcategories), dtype=object)
+    keys = names.str.extract(_SORT_KEY_RE)
+    keys['num'] = pd.to_numeric(keys['num']).fillna(0).astype(int)
+    order = keys.sort_values(['prefix', 'num'], kind='stable').index
+    return names[order].tolist()
+
+def pivot_metrics(category_df, metrics, subcategories, loggers):
+    """Pivot metric columns into subcategory x logger tables (missing cells are NaN)."""
+    import pandas as pd
+
+    present = [metric for metric in metrics if metric in category_df.columns]
+    pivot = None
+    if present:
+        # A single pivot_table call groups the rows once for every metric
+        pivot = category_df.pivot_table(index='test_subcategory', columns='logger',
+                                        values=present, aggfunc='first', observed=True)
+
+    tables = {}
+    for metric in metrics:
+        if pivot is not None and metric in pivot.columns.get_level_values(0):
+            table = pivot[metric]
+        else:
+            table = pd.DataFrame(dtype=float)
+        tables[metric] = table.reindex(index=subcategories, columns=loggers).astype(float)
+    return tables
+
+# (metric column, y-axis label, title, output file suffix) for each comparison plot
+PLOT_METRICS = [
+    ('mean_ns', 'Mean Execution Time (ns)', 'Mean Execution Time Comparison', 'mean_time'),
+    ('throughput_normalized', 'Throughput (elements/second)', 'Throughput Comparison', 'throughput'),
+    ('median_ns', 'Median Execution Time (ns)', 'Median Execution Time Comparison', 'median_time'),
+]
+
+# Each plotting thread keeps one Figure and clears it between plots
+_thread_state = threading.local()
+
+def render_bar_plot(table, xlabel, ylabel, title, path):
+    """Draw a grouped bar chart on this thread's reusable Figure and save it."""
+    from matplotlib.figure import Figure
+
+    fig = getattr(_thread_state, 'figure', None)
+    if fig is None:
+        # Standalone Figures are not tracked by pyplot, so threads don't share state
+        fig = _thread_state.figure = Figure(figsize=(12, 8))
+    fig.clear()
+
+    ax = fig.subplots()
+    table.fillna(0).plot.bar(ax=ax, width=0.8)
+    ax.set(xlabel=xlabel, ylabel=ylabel, title=title)
+    for label in ax.get_xticklabels():
+        label.set(rotation=45, ha='right', fontsize=10)
+    ax.legend()
+    fig.tight_layout()
+    fig.savefig(path, dpi=300)
 
 def create_comparison_plots(df, output_dir):
     """Create comparison plots for the benchmark data."""
-    os.makedirs(output_dir, exist_ok=True)
+    from cycler import cycler
+    from matplotlib import rcParams, style
 
-    # Get unique benchmark categories
-    benchmark_categories = df['test_category'].unique()
+    # Set plot style
+    style.use('ggplot')
+    rcParams['axes.prop_cycle'] = cycler(color=SET2_COLORS)
 
-    for category in benchmark_categories:
-        category_df = df[df['test_category'] == category]
+    os.makedirs(output_dir, exist_ok=True)
+
+    plots = []
 
+    # Split the frame by benchmark category in one pass
+    for category, category_df in df.groupby('test_category', observed=True, sort=False):
         # Group by test_subcategory for sorting and plotting
         test_subcategories = category_df['test_subcategory'].unique()
 
-        # Sort subcategories using custom sort key
-        sorted_subcategories = sorted(test_subcategories, key=custom_sort_key)
+        # Sort subcategories by prefix and trailing number
+        sorted_subcategories = sort_subcategories(test_subcategories)
 
         logger_types = category_df['logger'].unique()
 
-        # 1. Mean execution time comparison
-        plt.figure(figsize=(12, 8))
-        bar_width = 0.2
-        index = np.arange(len(sorted_subcategories))
-
-        for i, logger in enumerate(logger_types):
-            logger_data = []
-            for subcat in sorted_subcategories:
-                data = category_df[(category_df['logger'] == logger) &
-                                   (category_df['test_subcategory'] == subcat)]
-                if not data.empty and 'mean_ns' in data.columns:
-                    logger_data.append(data['mean_ns'].values[0])
-                else:
-                    logger_data.append(0)
-
-            plt.bar(index + i*bar_width, logger_data, bar_width, label=logger)
-
-        plt.xlabel('Test Parameters')
-        plt.ylabel('Mean Execution Time (ns)')
-        plt.title(f'{category} - Mean Execution Time Comparison')
-        #plt.xticks(index + bar_width * (len(logger_types) - 1) / 2, sorted_subcategories)
-        plt.xticks(
-            index + bar_width * (len(logger_types) - 1) / 2,
-            sorted_subcategories,
-            rotation=45,
-            ha='right',
-            fontsize=10
-        )
-        plt.legend()
-        plt.tight_layout()
-        plt.savefig(os.path.join(output_dir, f'{category}_mean_time.png'), dpi=300)
-        plt.close()
-
-        # 2. Throughput comparison
-        plt.figure(figsize=(12, 8))
-
-        for i, logger in enumerate(logger_types):
-            logger_data = []
-            for subcat in sorted_subcategories:
-                data = category_df[(category_df['logger'] == logger) &
-                                   (category_df['test_subcategory'] == subcat)]
-                if not data.empty and 'throughput_normalized' in data.columns:
-                    logger_data.append(data['throughput_normalized'].values[0])
-                else:
-                    logger_data.append(0)
-
-            plt.bar(index + i*bar_width, logger_data, bar_width, label=logger)
-
-        plt.xlabel('Test Parameters')
-        plt.ylabel('Throughput (elements/second)')
-        plt.title(f'{category} - Throughput Comparison')
-        #plt.xticks(index + bar_width * (len(logger_types) - 1) / 2, sorted_subcategories)
-        plt.xticks(
-            index + bar_width * (len(logger_types) - 1) / 2,
-            sorted_subcategories,
-            rotation=45,
-            ha='right',
-            fontsize=10
-        )
-        plt.legend()
-        plt.tight_layout()
-        plt.savefig(os.path.join(output_dir, f'{category}_throughput.png'), dpi=300)
-        plt.close()
-
-        # 3. Median execution time comparison
-        plt.figure(figsize=(12, 8))
-
-        for i, logger in enumerate(logger_types):
-            logger_data = []
-            for subcat in sorted_subcategories:
-                data = category_df[(category_df['logger'] == logger) &
-                                   (category_df['test_subcategory'] == subcat)]
-                if not data.empty and 'median_ns' in data.columns:
-                    logger_data.append(data['median_ns'].values[0])
-                else:
-                    logger_data.append(0)
-
-            plt.bar(index + i*bar_width, logger_data, bar_width, label=logger)
-
-        plt.xlabel('Test Parameters')
-        plt.ylabel('Median Execution Time (ns)')
-        plt.title(f'{category} - Median Execution Time Comparison')
-        #plt.xticks(index + bar_width * (len(logger_types) - 1) / 2, sorted_subcategories)
-        plt.xticks(
-            index + bar_width * (len(logger_types) - 1) / 2,
-            sorted_subcategories,
-            rotation=45,
-            ha='right',
-            fontsize=10
-        )
-        plt.legend()
-        plt.tight_layout()
-        plt.savefig(os.path.join(output_dir, f'{category}_median_time.png'), dpi=300)
-        plt.close()
+        pivots = pivot_metrics(category_df, [metric for metric, *_ in PLOT_METRICS],
+                               sorted_subcategories, logger_types)
+
+        # One bar chart per metric, logger bars grouped by test parameter
+        for metric, ylabel, title, suffix in PLOT_METRICS:
+            plots.append((pivots[metric], 'Test Parameters', ylabel, f'{category} - {title}',
+                          os.path.join(output_dir, f'{category}_{suffix}.png')))
+
+    # Render and PNG-encode the plots concurrently; Agg and zlib release the GIL
+    with ThreadPoolExecutor(max_workers=os.cpu_count()) as executor:
+        list(executor.map(lambda plot: render_bar_plot(*plot), plots))
+
+# Page header and stylesheet for the HTML summary table
+SUMMARY_HTML_HEADER = (
+    '<html><head><meta charset="utf-8"><title>Benchmark Summary</title>'
+    '<style>table {border-collapse: collapse; width: 100%;} '
+    'th, td {border: 1px solid #ddd; padding: 8px; text-align: left;} '
+    'tr:nth-child(even) {background-color: #f2f2f2;} '
+    'th {padding-top: 12px; padding-bottom: 12px; background-color: #4CAF50; color: white;}</style>'
+    '</head><body>'
+    '<h1>Benchmark Summary</h1>'
+)
 
 def generate_summary_table(df, output_dir):
     """Generate a summary table of the benchmark results."""
+    import pandas as pd
+
     summary_data = []
 
-    for category in df['test_category'].unique():
-        category_df = df[df['test_category'] == category]
-        for subcategory in sorted(category_df['test_subcategory'].unique(), key=custom_sort_key):
-            subcat_df = category_df[category_df['test_subcategory'] == subcategory]
+    for category, category_df in df.groupby('test_category', observed=True, sort=False):
+        sorted_subcategories = sort_subcategories(category_df['test_subcategory'].unique())
+        logger_types = category_df['logger'].unique()
+
+        pivots = pivot_metrics(category_df, ['mean_ns', 'throughput_normalized'],
+                               sorted_subcategories, logger_types)
+        # Pull the tables out as 2-D arrays once and index cells by position
+        mean_values = pivots['mean_ns'].to_numpy()
+        throughput_values = pivots['throughput_normalized'].to_numpy()
 
+        for j, subcategory in enumerate(sorted_subcategories):
             row = {
                 'Category': category,
                 'Test': subcategory,
             }
 
-            for logger in subcat_df['logger'].unique():
-                logger_data = subcat_df[subcat_df['logger'] == logger]
+            for i, logger in enumerate(logger_types):
+                mean_ns = mean_values[j, i]
+                if not math.isnan(mean_ns):
+                    row[f'{logger} Mean'] = format_time(mean_ns)
 
-                if not logger_data.empty:
-                    if 'mean_ns' in logger_data.columns:
-                        row[f'{logger} Mean'] = format_time(logger_data['mean_ns'].values[0])
-
-                    if 'throughput_normalized' in logger_data.columns:
-                        row[f'{logger} Throughput'] = format_throughput(logger_data['throughput_normalized'].values[0])
+                throughput = throughput_values[j, i]
+                if not math.isnan(throughput):
+                    row[f'{logger} Throughput'] = format_throughput(throughput)
 
             summary_data.append(row)
 
@@ -311,15 +288,9 @@ def generate_summary_table(df, output_dir):
 
     # Save as HTML
     html_path = os.path.join(output_dir, 'benchmark_summary.html')
-    with open(html_path, 'w') as f:
-        f.write('<html><head><title>Benchmark Summary</title>')
-        f.write('<style>table {border-collapse: collapse; width: 100%;} ')
-        f.write('th, td {border: 1px solid #ddd; padding: 8px; text-align: left;} ')
-        f.write('tr:nth-child(even) {background-color: #f2f2f2;} ')
-        f.write('th {padding-top: 12px; padding-bottom: 12px; background-color: #4CAF50; color: white;}</style>')
-        f.write('</head><body>')
-        f.write('<h1>Benchmark Summary</h1>')
-        f.write(summary_df.to_html(index=False))
+    with open(html_path, 'w', encoding='utf-8') as f:
+        f.write(SUMMARY_HTML_HEADER)
+        summary_df.to_html(buf=f, index=False, border=0)
         f.write('</body></html>')
 
     print(f"Summary table saved to {html_path}")
@@ -328,33 +299,33 @@ def main():
     # Configuration
     base_dir = '../target/criterion'  # Default location for Criterion results
     output_dir = 'benchmark_plots'  # Output directory for plots
+    cache_file = '.benchmark_cache.pkl'  # Parsed results from previous runs
 
-    # Find all Criterion benchmark reports
-    report_files = find_criterion_reports(base_dir)
-    print(f"Found {len(report_files)} benchmark report files")
+    # Find all Criterion benchmarks with saved results
+    benchmark_dirs = find_criterion_benchmarks(base_dir)
+    print(f"Found {len(benchmark_dirs)} benchmark results")
 
-    # Parse all reports
-    benchmark_data = []
-    for report_file in report_files:
-        data = parse_criterion_report(report_file)
-        if data:
-            benchmark_data.append(data)
+    # Parse all results, skipping benchmarks unchanged since the last run
+    benchmark_data = parse_benchmarks(benchmark_dirs, cache_file)
 
     if not benchmark_data:
         print("No benchmark data found. Check the path to your Criterion results.")
         return
 
+    import pandas as pd
+
     # Convert to DataFrame
     df = pd.DataFrame(benchmark_data)
 
     # Extract test category and subcategory from test_type
-    def extract_categories(test_type):
-        parts = test_type.split('/')
-        if len(parts) >= 2:
-            return parts[0], '/'.join(parts[1:])
-        return test_type, ""
-
-    df['test_category'], df['test_subcategory'] = zip(*df['test_type'].apply(extract_categories))
+    # (reindex guarantees column 1 exists even if no test_type contains a '/')
+    split = df['test_type'].str.split('/', n=1, expand=True).reindex(columns=[0, 1])
+    df['test_category'] = split[0]
+    df['test_subcategory'] = split[1].fillna('')
+
+    # Store repeated labels as categoricals so filters and pivots compare int codes
+    for column in ('logger', 'test_category', 'test_subcategory'):
+        df[column] = df[column].astype('category')
 
     # Create comparison plots
     create_comparison_plots(df, output_dir)
@@ -7,7 +7,7 @@ python -m venv benchmark_venv
 source benchmark_venv/bin/activate
 
 # Install required dependencies (if not already installed)
-pip install beautifulsoup4 pandas matplotlib seaborn numpy
+pip install orjson pandas matplotlib numpy
 
 # Run the script (assumes you're in the root of your rust-loguru project)
 ./benchmark_comparison.py